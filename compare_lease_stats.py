@@ -0,0 +1,137 @@
+import json
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+import parse_packet_events_into_events
+from packet_cost_calculator import collect_files_lease_stats, get_lease_list
+
+
+# Check on random raw events that streamed lease stats count the same leases
+# as keep_action_pairs(), with jobs spanning files, event ids duplicated
+# across files and jobs discarded by an extra event
+def random_raw_event_files(job_count, file_count, seed) -> list[list[dict]]:
+    rng = random.Random(seed)
+    event_count = 0
+
+    def raw_event(event_type, job_id, timestamp, machine_type):
+        nonlocal event_count
+        event_count = event_count + 1
+        return {
+            "id": f"event-{event_count}",
+            "type": event_type,
+            "created_at": datetime.fromtimestamp(timestamp, timezone.utc).strftime(
+                "%Y-%m-%dT%H:%M:%SZ"
+            ),
+            "interpolated": f"job-{job_id} ({machine_type}) was updated",
+        }
+
+    raw_events = []
+    for job_id in range(job_count):
+        machine_type = rng.choice(["c3.small.x86", "m3.large.x86", "n2.xlarge.x86"])
+        created_at = 1640995200 + rng.randint(0, 90 * 24 * 3600)
+        deleted_at = created_at + rng.choice([0, 3600, rng.randint(1, 48 * 3600)])
+        raw_events.append(
+            raw_event("instance.created", job_id, created_at, machine_type)
+        )
+        if rng.random() < 0.02:
+            # job never deleted
+            continue
+        raw_events.append(
+            raw_event("instance.deleted", job_id, deleted_at, machine_type)
+        )
+
+        extra = rng.random()
+        if extra < 0.02:
+            raw_events.append(
+                raw_event("instance.updated", job_id, created_at + 5, machine_type)
+            )
+        elif extra < 0.03:
+            raw_events.append(
+                raw_event("instance.created", job_id, created_at + 7, machine_type)
+            )
+
+    rng.shuffle(raw_events)
+    file_size = -(-len(raw_events) // file_count)
+    files = [
+        raw_events[i : i + file_size] for i in range(0, len(raw_events), file_size)
+    ]
+    # duplicated events, within a file and across files
+    for f in files:
+        f.extend(dict(e) for e in rng.sample(raw_events, len(raw_events) // 50))
+        rng.shuffle(f)
+
+    return files
+
+
+def compare(files, workers, relative_accuracy=0.01) -> int:
+    raw_event_list = [e for f in files for e in f]
+    dedup_event_list = parse_packet_events_into_events.dedup_event_ids(raw_event_list)
+    event_list = parse_packet_events_into_events.keep_action_pairs(dedup_event_list)
+    lease_list = get_lease_list(event_list)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filenames = []
+        for i, f in enumerate(files):
+            filename = os.path.join(tmp_dir, f"raw_events_{i}.json")
+            with open(filename, "w") as outfile:
+                json.dump(f, outfile)
+            filenames.append(filename)
+        stats = collect_files_lease_stats(filenames, relative_accuracy, workers)
+
+    expected_by_type = {None: lease_list}
+    for l in lease_list:
+        expected_by_type.setdefault(l.machine_type, []).append(l)
+
+    mismatches = 0
+    for machine_type, leases in expected_by_type.items():
+        if machine_type is None:
+            stats_list = stats.stats_by_type.values()
+        else:
+            stats_list = [stats.stats_by_type[machine_type]]
+
+        for attr in ("real_time", "billed_per_hour", "billed_per_min"):
+            samples = sorted(getattr(l, attr) for l in leases)
+            count = sum(getattr(s, attr).count for s in stats_list)
+            sum_ = sum(getattr(s, attr).sum for s in stats_list)
+            if count != len(samples) or sum_ != sum(samples):
+                print(f"MISMATCH {machine_type} {attr} count or sum")
+                mismatches = mismatches + 1
+                continue
+
+            if machine_type is None:
+                continue
+            for q in (0.5, 0.95, 0.99):
+                exact = samples[int(len(samples) * q)]
+                estimate = getattr(stats_list[0], attr).quantile(q)
+                tolerance = relative_accuracy * exact if attr == "real_time" else 0
+                if abs(estimate - exact) > tolerance:
+                    print(f"MISMATCH {machine_type} {attr} p{int(q * 100)}")
+                    mismatches = mismatches + 1
+
+    # machine types whose leases were all discarded have empty stats
+    for machine_type, s in stats.stats_by_type.items():
+        if machine_type not in expected_by_type and s.real_time.count > 0:
+            print(f"MISMATCH unexpected leases for {machine_type}")
+            mismatches = mismatches + 1
+
+    return mismatches
+
+
+def main() -> None:
+    mismatches = 0
+    for seed in range(3):
+        files = random_raw_event_files(3000, 3, seed)
+        for workers in (1, 3):
+            print(f"Compare seed {seed}, {workers} workers")
+            mismatches = mismatches + compare(files, workers)
+
+    if mismatches:
+        sys.exit(1)
+    print("Streamed and default lease stats match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import random
+import sys
+
+from event import ACQUIRE_INSTANCE_ACTION, RELEASE_INSTANCE_ACTION, Event
+from main import OnDemandPool, ShardedSimulator, SizedPool, simulate
+
+
+# Check on random workloads that the sharded simulation gives exactly the same
+# results as simulate()
+def random_event_list(
+    job_count, seed, long_job_ratio=0.0, never_released_ratio=0.0
+) -> list[Event]:
+    rng = random.Random(seed)
+    event_list = []
+    timestamp = 0
+    for i in range(job_count):
+        timestamp = timestamp + rng.expovariate(1 / 90)
+        job = f"job-{i}"
+        event_list.append(Event(timestamp, ACQUIRE_INSTANCE_ACTION, job))
+
+        if rng.random() < never_released_ratio:
+            continue
+        if rng.random() < long_job_ratio:
+            duration = rng.uniform(1, 5) * 24 * 3600
+        else:
+            duration = rng.uniform(60, 4 * 3600)
+        event_list.append(Event(timestamp + duration, RELEASE_INSTANCE_ACTION, job))
+
+    event_list.sort(key=lambda x: x.timestamp)
+    return event_list
+
+
+def simulation_results(pool_list):
+    return [
+        (
+            pool.usage_sum,
+            pool.sample_count,
+            pool.billed_time_sec_total,
+            pool.acquired_samples,
+            pool.snapshot(),
+        )
+        for pool in pool_list
+    ]
+
+
+def compare(event_list, shard_count, pool_sizes, billing_period=60, sample_period=5):
+    simulation_duration_sec = event_list[-1].timestamp - event_list[0].timestamp
+    mismatches = 0
+    with ShardedSimulator(event_list, shard_count) as simulator:
+        for pool_size in pool_sizes:
+            results = []
+            for sharded in (False, True):
+                pool_list = [
+                    SizedPool(
+                        f"sizedpool_{pool_size}",
+                        pool_size,
+                        simulation_duration_sec,
+                        billing_period,
+                    ),
+                    OnDemandPool(f"ondemand_{pool_size}", billing_period),
+                ]
+                if sharded:
+                    simulator.simulate(pool_list, sample_period)
+                else:
+                    simulate(event_list, pool_list, sample_period)
+                results.append(simulation_results(pool_list))
+
+            if results[0] != results[1]:
+                print(f"MISMATCH pool_size={pool_size} shards={shard_count}")
+                mismatches = mismatches + 1
+
+    return mismatches
+
+
+def main() -> None:
+    workloads = {
+        "regular": dict(),
+        "long jobs": dict(long_job_ratio=0.01),
+        "never released": dict(never_released_ratio=0.001),
+    }
+    mismatches = 0
+    for seed, (name, options) in enumerate(workloads.items()):
+        event_list = random_event_list(20000, seed, **options)
+        for shard_count in (2, 7):
+            print(f"Compare {name} workload, {shard_count} shards")
+            mismatches = mismatches + compare(event_list, shard_count, [0, 3, 10])
+
+    if mismatches:
+        sys.exit(1)
+    print("Sharded and sequential simulations are identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import heapq
+import json
+import os
+import tempfile
+
+from event import Event
+from json_stream import iter_json_array
+
+# Number of events sorted in memory before being spilled to disk
+EXTERNAL_SORT_RUN_SIZE = 1000000
+
+
+def iter_event_file(filename: str):
+    with open(filename) as json_file:
+        for d in iter_json_array(json_file):
+            yield Event(**d)
+
+
+def scan_event_file(filename: str):
+    is_sorted = True
+    first_timestamp = None
+    last_timestamp = None
+    previous_timestamp = None
+    for e in iter_event_file(filename):
+        if previous_timestamp is not None and e.timestamp < previous_timestamp:
+            is_sorted = False
+        if first_timestamp is None or e.timestamp < first_timestamp:
+            first_timestamp = e.timestamp
+        if last_timestamp is None or e.timestamp > last_timestamp:
+            last_timestamp = e.timestamp
+        previous_timestamp = e.timestamp
+
+    return is_sorted, first_timestamp, last_timestamp
+
+
+def write_run(run_dir: str, run: list[Event]) -> str:
+    run.sort(key=lambda x: x.timestamp)
+    fd, run_file = tempfile.mkstemp(suffix=".json", dir=run_dir)
+    with os.fdopen(fd, "w") as outfile:
+        json.dump([e.__dict__ for e in run], outfile)
+    return run_file
+
+
+def write_sorted_runs(filename: str, run_dir: str, run_size: int) -> list[str]:
+    run_files = []
+    run = []
+    for e in iter_event_file(filename):
+        run.append(e)
+        if len(run) == run_size:
+            run_files.append(write_run(run_dir, run))
+            run = []
+    if run:
+        run_files.append(write_run(run_dir, run))
+
+    return run_files
+
+
+class EventStream:
+    """Time-ordered stream of the events of several files.
+
+    Files already sorted by timestamp are read as is, the others are split
+    into sorted runs spilled to a temporary directory. Iterating the stream
+    lazily merges all of them, so only one event per file or run is held in
+    memory. Events sharing a timestamp keep the order they have in the
+    files, like sorting the concatenation of all files would.
+    """
+
+    def __init__(self, filenames: list[str], run_size: int = EXTERNAL_SORT_RUN_SIZE):
+        self.run_dir = tempfile.TemporaryDirectory(prefix="events_")
+        self.sorted_files = []
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+        for filename in filenames:
+            is_sorted, first_timestamp, last_timestamp = scan_event_file(filename)
+            if first_timestamp is None:
+                continue
+
+            if is_sorted:
+                self.sorted_files.append(filename)
+            else:
+                print(f"Sort {filename} in runs of {run_size} events...")
+                self.sorted_files.extend(
+                    write_sorted_runs(filename, self.run_dir.name, run_size)
+                )
+
+            if self.first_timestamp is None or first_timestamp < self.first_timestamp:
+                self.first_timestamp = first_timestamp
+            if self.last_timestamp is None or last_timestamp > self.last_timestamp:
+                self.last_timestamp = last_timestamp
+
+    def __iter__(self):
+        return heapq.merge(
+            *[iter_event_file(f) for f in self.sorted_files],
+            key=lambda x: x.timestamp,
+        )
+
+    def close(self):
+        self.run_dir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
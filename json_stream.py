@@ -0,0 +1,69 @@
+import json
+
+JSON_WHITESPACES = " \t\r\n"
+# Characters that can continue a number decoded at the end of the buffer
+JSON_NUMBER_CONTINUATIONS = "0123456789.eE+-"
+
+
+def iter_json_array(json_file, chunk_size: int = 1 << 16):
+    """Yield the items of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+    # "[" is expected first, then an item or "]", then after each item a ","
+    # followed by another item, or "]"
+    expected = "["
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in JSON_WHITESPACES:
+            pos = pos + 1
+
+        need_more = pos == len(buffer)
+        if not need_more:
+            char = buffer[pos]
+            if expected == "[":
+                if char != "[":
+                    raise ValueError("expected a JSON array")
+                pos = pos + 1
+                expected = "item or ]"
+            elif expected == ", or ]":
+                if char == "]":
+                    return
+                if char != ",":
+                    raise ValueError(f"expected ',' or ']' in JSON array, got {char!r}")
+                pos = pos + 1
+                expected = "item"
+            elif char == "]" and expected == "item or ]":
+                return
+            elif char in ",]":
+                raise ValueError(f"expected an item in JSON array, got {char!r}")
+            else:
+                # An item ending the buffer may be truncated, e.g. "1." is
+                # decoded as 1, only accept it once a following character or
+                # the end of file is read
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                    if not eof:
+                        need_more = end == len(buffer) or (
+                            isinstance(item, (int, float))
+                            and not isinstance(item, bool)
+                            and buffer[end] in JSON_NUMBER_CONTINUATIONS
+                        )
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    need_more = True
+
+                if not need_more:
+                    pos = end
+                    expected = ", or ]"
+                    yield item
+
+        if need_more:
+            if eof:
+                raise ValueError("unexpected end of JSON array")
+            chunk = json_file.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
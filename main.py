@@ -1,12 +1,16 @@
+import argparse
+import copy
 import csv
-import json
+import multiprocessing
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
 
 import matplotlib.pyplot as plt
 import numpy as np
 
 from event import ACQUIRE_INSTANCE_ACTION, Event
+from event_stream import EXTERNAL_SORT_RUN_SIZE, EventStream
 
 class SizedPool:
     # Define how much time an instance can be reused after it got released
@@ -52,13 +56,23 @@ class SizedPool:
     def usage(self):
         return self.usage_sum / self.sample_count
 
+    def snapshot(self):
+        return (tuple(self.running_jobs), tuple(self.cleaning_until))
+
+    def restore(self, state):
+        running_jobs, cleaning_until = state
+        self.running_jobs = list(running_jobs)
+        self.cleaning_until = list(cleaning_until)
+
 
 class OnDemandPool:
     def __init__(self, name, billing_period_sec):
         self.name = name
         self.billing_period_sec = billing_period_sec
 
-        self.running_jobs = []
+        # acquire events per job, a job may be acquired several times
+        self.running_jobs = {}
+        self.running_count = 0
 
         self.usage_sum = 0
         self.sample_count = 0
@@ -67,19 +81,20 @@ class OnDemandPool:
         self.acquired_samples = []
 
     def acquire(self, event):
-        self.running_jobs.append(event)
+        self.running_jobs.setdefault(event.job, []).append(event)
+        self.running_count = self.running_count + 1
         return True
 
     def release(self, event: Event) -> bool:
-        acquired_event = None
-        for e in self.running_jobs:
-            if e.job == event.job:
-                acquired_event = e
-                break
-
-        if not acquired_event:
+        job_events = self.running_jobs.get(event.job)
+        if not job_events:
             return False
 
+        acquired_event = job_events.pop(0)
+        if not job_events:
+            del self.running_jobs[event.job]
+        self.running_count = self.running_count - 1
+
         self.billed_time_sec_total = (
             self.billed_time_sec_total
             + (
@@ -91,41 +106,231 @@ class OnDemandPool:
             )
             * self.billing_period_sec
         )
-
-        self.running_jobs.remove(acquired_event)
         return True
 
     def observe(self):
-        self.usage_sum = self.usage_sum + len(self.running_jobs)
+        self.usage_sum = self.usage_sum + self.running_count
         self.sample_count = self.sample_count + 1
-        self.acquired_samples.append(len(self.running_jobs))
+        self.acquired_samples.append(self.running_count)
 
     def usage(self):
         return self.usage_sum / self.sample_count
 
+    def snapshot(self):
+        # acquire events are kept whole: their timestamp is the start of the
+        # billing period that is still open
+        return tuple(
+            (e.timestamp, e.action, e.job)
+            for job_events in self.running_jobs.values()
+            for e in job_events
+        )
+
+    def restore(self, state):
+        self.running_jobs = {}
+        self.running_count = 0
+        for timestamp, action, job in state:
+            self.acquire(Event(timestamp=timestamp, action=action, job=job))
+
 
 def observe_pools(pool_list):
     for pool in pool_list:
         pool.observe()
 
 
-def simulate(event_list, pool_list, sample_period):
-    sample_start = event_list[0].timestamp
+def dispatch_event(event, pool_list):
+    for pool in pool_list:
+        if event.action == ACQUIRE_INSTANCE_ACTION:
+            success = pool.acquire(event)
+        else:
+            success = pool.release(event)
+
+        if success:
+            break
+
+
+def simulate_event(event, pool_list, sample_period, sample_start, sample_count):
+    sample_count_from_start = int((event.timestamp - sample_start) / sample_period)
+    for i in range(sample_count_from_start - sample_count):
+        observe_pools(pool_list)
+
+    dispatch_event(event, pool_list)
+    return sample_count_from_start
+
+
+# Pool configurations simulated together by main(), each pass over the
+# events keeps the usage samples of all its configurations in memory
+CONFIGURATIONS_PER_PASS = 4
+
+
+def simulate_pool_lists(events, pool_lists, sample_period):
+    # events can be any time-ordered iterable, e.g. a lazy EventStream. Every
+    # pool list sees the same events and samples, so they are all simulated
+    # in a single pass over the events.
+    sample_start = None
     sample_count = 0
-    for event in event_list:
+    for event in events:
+        if sample_start is None:
+            sample_start = event.timestamp
         sample_count_from_start = int((event.timestamp - sample_start) / sample_period)
         for i in range(sample_count_from_start - sample_count):
-            observe_pools(pool_list)
+            for pool_list in pool_lists:
+                observe_pools(pool_list)
         sample_count = sample_count_from_start
 
-        for pool in pool_list:
-            if event.action == ACQUIRE_INSTANCE_ACTION:
-                success = pool.acquire(event)
-            else:
-                success = pool.release(event)
+        for pool_list in pool_lists:
+            dispatch_event(event, pool_list)
+
 
-            if success:
-                break
+def simulate(events, pool_list, sample_period):
+    simulate_pool_lists(events, [pool_list], sample_period)
+
+
+# Time-sharded simulation
+#
+# The event list is split into consecutive shards simulated in parallel by
+# worker processes. The pool state at the start of each shard (running jobs,
+# cleaning deadlines, open on-demand billing periods) is computed exactly by
+# the parent, which only replays acquisitions and releases without sampling
+# the pools. A shard is handed to a worker as soon as its initial state is
+# known, so the replay of the next shards runs while it is simulated. Shard
+# results are then concatenated, giving exactly the results of simulate().
+
+# Events of the sharded simulation, inherited by worker processes
+shard_event_list = []
+
+
+def init_shard_worker(event_list):
+    global shard_event_list
+    shard_event_list = event_list
+
+
+def snapshot_pools(pool_list):
+    return tuple(pool.snapshot() for pool in pool_list)
+
+
+def restore_pools(pool_list, state):
+    for pool, pool_state in zip(pool_list, state):
+        pool.restore(pool_state)
+
+
+def simulate_shard(
+    start, end, pool_list, state, sample_period, sample_start, sample_count
+):
+    # pool_list is a copy sent to the worker, counters are accumulated from
+    # zero and added to the ones of the parent
+    restore_pools(pool_list, state)
+    for pool in pool_list:
+        pool.usage_sum = 0
+        pool.sample_count = 0
+        pool.billed_time_sec_total = 0
+        pool.acquired_samples = []
+
+    for event in shard_event_list[start:end]:
+        sample_count = simulate_event(
+            event, pool_list, sample_period, sample_start, sample_count
+        )
+
+    return (
+        [
+            (
+                pool.usage_sum,
+                pool.sample_count,
+                pool.billed_time_sec_total,
+                pool.acquired_samples,
+            )
+            for pool in pool_list
+        ],
+        snapshot_pools(pool_list),
+    )
+
+
+class ShardedSimulator:
+    """Run simulate() on several processes by splitting events in time shards.
+
+    Worker processes are started once and receive the event list once, they
+    are reused to simulate as many pool lists as needed. Workers are forked
+    so that they share the event list with the parent; where fork is not
+    available (Windows) the event list is pickled to every worker.
+    """
+
+    def __init__(self, event_list, shard_count):
+        self.event_list = event_list
+        self.bounds = []
+        self.executor = None
+        if not event_list:
+            return
+
+        shard_count = max(1, min(shard_count, len(event_list)))
+        shard_size = -(-len(event_list) // shard_count)
+        self.bounds = [
+            (start, min(start + shard_size, len(event_list)))
+            for start in range(0, len(event_list), shard_size)
+        ]
+        if len(self.bounds) > 1:
+            mp_context = None
+            if "fork" in multiprocessing.get_all_start_methods():
+                mp_context = multiprocessing.get_context("fork")
+            self.executor = ProcessPoolExecutor(
+                max_workers=len(self.bounds),
+                mp_context=mp_context,
+                initializer=init_shard_worker,
+                initargs=(event_list,),
+            )
+
+    def simulate(self, pool_list, sample_period):
+        event_list = self.event_list
+        if len(self.bounds) <= 1:
+            simulate(event_list, pool_list, sample_period)
+            return
+
+        sample_start = event_list[0].timestamp
+        replay_pool_list = copy.deepcopy(pool_list)
+        futures = []
+        for start, end in self.bounds:
+            # Sample count reached by simulate() right before the shard
+            sample_count = 0
+            if start > 0:
+                sample_count = int(
+                    (event_list[start - 1].timestamp - sample_start) / sample_period
+                )
+            futures.append(
+                self.executor.submit(
+                    simulate_shard,
+                    start,
+                    end,
+                    pool_list,
+                    snapshot_pools(replay_pool_list),
+                    sample_period,
+                    sample_start,
+                    sample_count,
+                )
+            )
+
+            if end < len(event_list):
+                for event in event_list[start:end]:
+                    dispatch_event(event, replay_pool_list)
+
+        for future in futures:
+            shard_counters, state = future.result()
+            for pool, (usage_sum, samples_taken, billed_time, samples) in zip(
+                pool_list, shard_counters
+            ):
+                pool.usage_sum = pool.usage_sum + usage_sum
+                pool.sample_count = pool.sample_count + samples_taken
+                pool.billed_time_sec_total = pool.billed_time_sec_total + billed_time
+                pool.acquired_samples.extend(samples)
+
+        restore_pools(pool_list, state)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 def plot_poolsize_billed_time(
@@ -249,55 +454,132 @@ def dump_poolsize_billed_time(
         billed_time_data.writerows(rows)
 
 
+def create_pool_list(billing_period, pool_size, simulation_duration_sec):
+    on_demand_pool = OnDemandPool(
+        f"ondemand_{pool_size}_{billing_period}", billing_period
+    )
+    sized_pool = SizedPool(
+        "sizedpool_{pool_size}_{billing_period}",
+        pool_size,
+        simulation_duration_sec,
+        billing_period,
+    )
+    return [sized_pool, on_demand_pool]
+
+
+def summarize_pool_list(pool_list, billing_period):
+    # Plot the usage samples and keep only totals, so that samples of a
+    # simulated configuration can be dropped
+    sized_pool, on_demand_pool = pool_list
+    plot_pool_usage(on_demand_pool, sized_pool, billing_period)
+    return (
+        on_demand_pool.billed_time_sec_total,
+        sized_pool.billed_time_sec_total,
+        on_demand_pool.usage(),
+        sized_pool.usage(),
+    )
+
+
 def main():
     # filename = "output.csv"
     # job_list = parse_data_into_jobs(filename)
     # event_list = event_list_from_job_list(job_list)
-    event_file = sys.argv[1]
-    with open(event_file) as json_file:
-        event_list = json.load(json_file, object_hook=lambda d: Event(**d))
-    event_list.sort(key=lambda x: x.timestamp)
-    simulation_duration_sec = event_list[-1].timestamp - event_list[0].timestamp
-    print(
-        "Simulation duration: {} -> {}s".format(
-            timedelta(seconds=simulation_duration_sec),
-            simulation_duration_sec,
-        )
+    parser = argparse.ArgumentParser()
+    parser.add_argument("event_files", nargs="+")
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="split each simulation into time shards simulated in parallel",
     )
+    parser.add_argument(
+        "--sort-run-size",
+        type=int,
+        default=EXTERNAL_SORT_RUN_SIZE,
+        help="events sorted in memory at once for files not sorted by timestamp",
+    )
+    parser.add_argument(
+        "--configurations-per-pass",
+        type=int,
+        default=CONFIGURATIONS_PER_PASS,
+        help="pool configurations simulated by each pass over the events",
+    )
+    args = parser.parse_args()
 
     billing_period_matrix = [60, 3600]
     pool_size_matrix = list(range(0, 21))
     sample_period = 5
-
-    billed_time_on_demand_pool = []
-    billed_time_sized_pool = []
-
-    average_usage_on_demand_pool = []
-    average_usage_sized_pool = []
-
-    for billing_period in billing_period_matrix:
-        for pool_size in pool_size_matrix:
-            on_demand_pool = OnDemandPool(
-                f"ondemand_{pool_size}_{billing_period}", billing_period
-            )
-            sized_pool = SizedPool(
-                "sizedpool_{pool_size}_{billing_period}",
-                pool_size,
+    configurations = [
+        (billing_period, pool_size)
+        for billing_period in billing_period_matrix
+        for pool_size in pool_size_matrix
+    ]
+
+    summaries = {}
+    with EventStream(args.event_files, args.sort_run_size) as event_stream:
+        if event_stream.first_timestamp is None:
+            sys.exit(f"No events in {', '.join(args.event_files)}")
+
+        simulation_duration_sec = (
+            event_stream.last_timestamp - event_stream.first_timestamp
+        )
+        print(
+            "Simulation duration: {} -> {}s".format(
+                timedelta(seconds=simulation_duration_sec),
                 simulation_duration_sec,
-                billing_period,
             )
-            pool_list = [sized_pool, on_demand_pool]
-
-            print(f"Simulate pool_size={pool_size} billing_period={billing_period}")
-            simulate(event_list, pool_list, sample_period)
-
-            plot_pool_usage(on_demand_pool, sized_pool, billing_period)
+        )
 
-            billed_time_on_demand_pool.append(on_demand_pool.billed_time_sec_total)
-            billed_time_sized_pool.append(sized_pool.billed_time_sec_total)
+        if args.shards > 1:
+            # shards are cut out of the event list, it has to be in memory
+            with ShardedSimulator(list(event_stream), args.shards) as simulator:
+                for billing_period, pool_size in configurations:
+                    print(
+                        f"Simulate pool_size={pool_size} billing_period={billing_period}"
+                    )
+                    pool_list = create_pool_list(
+                        billing_period, pool_size, simulation_duration_sec
+                    )
+                    simulator.simulate(pool_list, sample_period)
+                    summaries[(billing_period, pool_size)] = summarize_pool_list(
+                        pool_list, billing_period
+                    )
+        else:
+            # Usage samples of every configuration of a pass are kept until
+            # the end of the pass, passes bound the memory they take
+            configurations_per_pass = max(1, args.configurations_per_pass)
+            for i in range(0, len(configurations), configurations_per_pass):
+                pass_configurations = configurations[i : i + configurations_per_pass]
+                print(
+                    "Simulate "
+                    + ", ".join(
+                        f"pool_size={pool_size} billing_period={billing_period}"
+                        for billing_period, pool_size in pass_configurations
+                    )
+                )
+                pool_lists = [
+                    create_pool_list(billing_period, pool_size, simulation_duration_sec)
+                    for billing_period, pool_size in pass_configurations
+                ]
+                simulate_pool_lists(event_stream, pool_lists, sample_period)
+                for (billing_period, pool_size), pool_list in zip(
+                    pass_configurations, pool_lists
+                ):
+                    summaries[(billing_period, pool_size)] = summarize_pool_list(
+                        pool_list, billing_period
+                    )
 
-            average_usage_on_demand_pool.append(on_demand_pool.usage())
-            average_usage_sized_pool.append(sized_pool.usage())
+    for billing_period in billing_period_matrix:
+        billed_time_on_demand_pool = []
+        billed_time_sized_pool = []
+        average_usage_on_demand_pool = []
+        average_usage_sized_pool = []
+        for pool_size in pool_size_matrix:
+            summary = summaries[(billing_period, pool_size)]
+            billed_time_on_demand_pool.append(summary[0])
+            billed_time_sized_pool.append(summary[1])
+            average_usage_on_demand_pool.append(summary[2])
+            average_usage_sized_pool.append(summary[3])
 
         plot_poolsize_billed_time(
             billing_period,
@@ -317,11 +599,6 @@ def main():
             average_usage_on_demand_pool,
             average_usage_sized_pool,
         )
-        billed_time_on_demand_pool = []
-        billed_time_sized_pool = []
-        average_usage_on_demand_pool = []
-        average_usage_sized_pool = []
-
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,11 @@
+import argparse
+import itertools
 import json
-import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 import parse_packet_events_into_events
+from json_stream import iter_json_array
+from quantile_sketch import ExactQuantiles, QuantileSketch
 
 
 class Lease:
@@ -41,6 +45,197 @@ def get_lease_list(event_list):
     return lease_list
 
 
+def iter_raw_events(filenames: list[str]):
+    for filename in filenames:
+        with open(filename) as json_file:
+            yield from iter_json_array(json_file)
+
+
+def lease_from_event_pair(first, second):
+    # same rule as keep_action_pairs(): a job makes a lease only if it has
+    # exactly one created and one deleted event
+    if first["type"] == "instance.created" and second["type"] == "instance.deleted":
+        return Lease.from_events(first, second)
+    if first["type"] == "instance.deleted" and second["type"] == "instance.created":
+        return Lease.from_events(second, first)
+    return None
+
+
+class LeaseStats:
+    def __init__(self, relative_accuracy: float):
+        self.real_time = QuantileSketch(relative_accuracy)
+        # billed durations are whole hours or minutes, few distinct values
+        self.billed_per_hour = ExactQuantiles()
+        self.billed_per_min = ExactQuantiles()
+
+    def add(self, lease: Lease):
+        self.real_time.add(lease.real_time)
+        self.billed_per_hour.add(lease.billed_per_hour)
+        self.billed_per_min.add(lease.billed_per_min)
+
+    def remove(self, lease: Lease):
+        self.real_time.remove(lease.real_time)
+        self.billed_per_hour.remove(lease.billed_per_hour)
+        self.billed_per_min.remove(lease.billed_per_min)
+
+    def merge(self, other: "LeaseStats"):
+        self.real_time.merge(other.real_time)
+        self.billed_per_hour.merge(other.billed_per_hour)
+        self.billed_per_min.merge(other.billed_per_min)
+
+
+class JobEvents:
+    # One per job, kept for the whole run: the event of a job waiting for its
+    # second event is kept, after that only the lease if the job makes one
+    __slots__ = ("event_ids", "pending_event", "lease")
+
+    def __init__(self):
+        self.event_ids = ()
+        self.pending_event = None
+        self.lease = None
+
+
+class StreamingLeaseStats:
+    """Lease stats per machine type, updated as raw events are parsed.
+
+    Events are deduplicated and grouped per job like dedup_event_ids() and
+    keep_action_pairs() do, so the same leases are counted as in the default
+    mode. A later event can still discard a job, hence the event ids of every
+    job are kept and a lease is removed from the stats when its job gets an
+    extra event.
+    """
+
+    def __init__(self, relative_accuracy: float):
+        self.relative_accuracy = relative_accuracy
+        self.stats_by_type = {}
+        self.seen_event_ids = set()
+        self.events_per_job = {}
+
+    def add_lease(self, lease: Lease):
+        if lease.machine_type not in self.stats_by_type:
+            self.stats_by_type[lease.machine_type] = LeaseStats(
+                self.relative_accuracy
+            )
+        self.stats_by_type[lease.machine_type].add(lease)
+
+    def remove_lease(self, lease: Lease):
+        self.stats_by_type[lease.machine_type].remove(lease)
+
+    def add_event(self, e):
+        if e["id"] in self.seen_event_ids:
+            return
+        self.seen_event_ids.add(e["id"])
+
+        job_id = e["interpolated"].split()[0]
+        job = self.events_per_job.get(job_id)
+        if job is None:
+            job = self.events_per_job[job_id] = JobEvents()
+
+        if job.lease:
+            self.remove_lease(job.lease)
+            job.lease = None
+
+        job.event_ids = job.event_ids + (e["id"],)
+        if len(job.event_ids) == 1:
+            job.pending_event = {
+                k: e[k] for k in ("type", "created_at", "interpolated")
+            }
+        elif len(job.event_ids) == 2:
+            job.lease = lease_from_event_pair(job.pending_event, e)
+            job.pending_event = None
+            if job.lease:
+                self.add_lease(job.lease)
+
+    def merge(self, other: "StreamingLeaseStats"):
+        # other holds events following ours, e.g. parsed from the next file.
+        # Its jobs that also have events here or whose events duplicate ours
+        # are taken out of its stats and merged into our jobs.
+        merged_jobs = []
+        for job_id, job in other.events_per_job.items():
+            if job_id in self.events_per_job or any(
+                i in self.seen_event_ids for i in job.event_ids
+            ):
+                if job.lease:
+                    other.remove_lease(job.lease)
+                merged_jobs.append((job_id, job))
+            else:
+                self.events_per_job[job_id] = job
+                self.seen_event_ids.update(job.event_ids)
+
+        for k, v in other.stats_by_type.items():
+            if k not in self.stats_by_type:
+                self.stats_by_type[k] = v
+            else:
+                self.stats_by_type[k].merge(v)
+
+        for job_id, other_job in merged_jobs:
+            self.merge_job(job_id, other_job)
+
+    def merge_job(self, job_id, other_job: JobEvents):
+        new_event_ids = tuple(
+            i for i in other_job.event_ids if i not in self.seen_event_ids
+        )
+        if not new_event_ids:
+            return
+        self.seen_event_ids.update(new_event_ids)
+
+        job = self.events_per_job.get(job_id)
+        if job is None:
+            job = self.events_per_job[job_id] = JobEvents()
+        if job.lease:
+            self.remove_lease(job.lease)
+            job.lease = None
+
+        previous_count = len(job.event_ids)
+        job.event_ids = job.event_ids + new_event_ids
+        if len(job.event_ids) == 1:
+            job.pending_event = other_job.pending_event
+        elif len(job.event_ids) == 2:
+            if previous_count == 1 and len(other_job.event_ids) == 1:
+                job.lease = lease_from_event_pair(
+                    job.pending_event, other_job.pending_event
+                )
+            else:
+                # the other job holds both events, one of them being ours
+                job.lease = other_job.lease
+            job.pending_event = None
+            if job.lease:
+                self.add_lease(job.lease)
+        else:
+            job.pending_event = None
+
+
+def collect_lease_stats(filenames: list[str], relative_accuracy: float):
+    stats = StreamingLeaseStats(relative_accuracy)
+    for e in iter_raw_events(filenames):
+        stats.add_event(e)
+
+    return stats
+
+
+def collect_files_lease_stats(
+    filenames: list[str], relative_accuracy: float, workers: int = 1
+):
+    if workers <= 1:
+        return collect_lease_stats(filenames, relative_accuracy)
+
+    # files are merged in order, so leases spanning two files and events
+    # duplicated across files are handled like in a single pass
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        stats = None
+        for file_stats in executor.map(
+            collect_lease_stats,
+            [[filename] for filename in filenames],
+            itertools.repeat(relative_accuracy),
+        ):
+            if stats is None:
+                stats = file_stats
+            else:
+                stats.merge(file_stats)
+
+    return stats
+
+
 def print_stats_duration_list(label: str,samples: list[float]):
     samples.sort()
     sum_ = int(sum(samples))
@@ -51,6 +246,15 @@ def print_stats_duration_list(label: str,samples: list[float]):
     print(f"{label} samples {len(samples)} sum {sum_}s avg {avg} median {median} p95 {p95} p99 {p99}")
 
 
+def print_stats_sketch(label: str, sketch):
+    sum_ = int(sketch.sum)
+    avg = timedelta(seconds=sketch.sum / sketch.count)
+    median = timedelta(seconds=sketch.quantile(0.5))
+    p95 = timedelta(seconds=sketch.quantile(0.95))
+    p99 = timedelta(seconds=sketch.quantile(0.99))
+    print(f"{label} samples {sketch.count} sum {sum_}s avg {avg} median {median} p95 {p95} p99 {p99}")
+
+
 def group_by_machine_types(lease_list: list[Lease]):
     lease_by_type = {}
     for l in lease_list:
@@ -80,11 +284,61 @@ def print_stats(lease_list):
         print_stats_duration_list("Per min ",[l.billed_per_min for l in v])
 
 
+def print_streaming_stats(stats: StreamingLeaseStats):
+    relative_accuracy = stats.relative_accuracy
+    # every lease of a machine type may have been discarded by a later event
+    stats_by_type = {
+        k: v for k, v in stats.stats_by_type.items() if v.real_time.count > 0
+    }
+    all_stats = LeaseStats(relative_accuracy)
+    for v in stats_by_type.values():
+        all_stats.merge(v)
+
+    print(f"ALL MACHINE TYPES (real time quantiles within {relative_accuracy:.2%})")
+    print_stats_sketch("Real    ", all_stats.real_time)
+    print_stats_sketch("Per hour", all_stats.billed_per_hour)
+    print_stats_sketch("Per min ", all_stats.billed_per_min)
+
+    for k, v in stats_by_type.items():
+        print(f"MACHINE TYPE {k.upper()}")
+        print_stats_sketch("Real    ", v.real_time)
+        print_stats_sketch("Per hour", v.billed_per_hour)
+        print_stats_sketch("Per min ", v.billed_per_min)
+
+
 def main() -> None:
-    input = sys.argv[1]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="+", help="raw packet event files")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="compute stats on the fly with quantile sketches",
+    )
+    parser.add_argument(
+        "--relative-accuracy",
+        type=float,
+        default=0.01,
+        help="relative error of streamed quantiles",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="stream input files in parallel",
+    )
+    args = parser.parse_args()
+
+    if args.stream:
+        stats = collect_files_lease_stats(
+            args.inputs, args.relative_accuracy, args.workers
+        )
+        print_streaming_stats(stats)
+        return
 
-    with open(input) as json_file:
-        raw_event_list = json.load(json_file)
+    raw_event_list = []
+    for input in args.inputs:
+        with open(input) as json_file:
+            raw_event_list.extend(json.load(json_file))
 
     dedup_event_list = parse_packet_events_into_events.dedup_event_ids(raw_event_list)
     event_list = parse_packet_events_into_events.keep_action_pairs(dedup_event_list)
@@ -0,0 +1,131 @@
+import math
+from collections import Counter
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch for positive samples (DDSketch).
+
+    Samples are counted in logarithmic buckets so that every quantile is
+    returned within `relative_accuracy` of the exact one, whatever the number
+    of samples, and within the range of the added samples. Count and sum are
+    kept exact. Two sketches built with the same accuracy can be merged, e.g.
+    to combine monthly files or parallel workers, and samples can be removed.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(
+                f"relative accuracy must be in ]0, 1[, got {relative_accuracy}"
+            )
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0
+        # removing a sample does not shrink this range, it stays a valid bound
+        self.min = None
+        self.max = None
+
+    def add(self, value: float):
+        self.count = self.count + 1
+        self.sum = self.sum + value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zero_count = self.zero_count + 1
+            return
+
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + 1
+
+    def remove(self, value: float):
+        # value must have been added before
+        self.count = self.count - 1
+        self.sum = self.sum - value
+        if value <= 0:
+            self.zero_count = self.zero_count - 1
+            return
+
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[key] = self.bins[key] - 1
+        if self.bins[key] == 0:
+            del self.bins[key]
+
+    def merge(self, other: "QuantileSketch"):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(
+                "cannot merge sketches with different relative accuracies: "
+                f"{self.relative_accuracy} and {other.relative_accuracy}"
+            )
+        self.count = self.count + other.count
+        self.sum = self.sum + other.sum
+        self.zero_count = self.zero_count + other.zero_count
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            raise ValueError("cannot compute a quantile of an empty sketch")
+
+        # same rank as samples[int(len(samples) * q)] on a sorted list
+        rank = min(int(self.count * q), self.count - 1)
+        cumulated = self.zero_count
+        if rank < cumulated:
+            return 0
+        for key in sorted(self.bins):
+            cumulated = cumulated + self.bins[key]
+            if rank < cumulated:
+                # bucket `key` holds values in ]gamma^(key-1), gamma^key]
+                estimate = 2 * self.gamma**key / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+
+
+class ExactQuantiles:
+    """Exact quantiles of samples taking few distinct values.
+
+    Same interface as QuantileSketch, samples are counted per value, which
+    suits durations billed per hour or per minute.
+    """
+
+    def __init__(self):
+        self.values = Counter()
+        self.count = 0
+        self.sum = 0
+
+    def add(self, value: float):
+        self.count = self.count + 1
+        self.sum = self.sum + value
+        self.values[value] = self.values[value] + 1
+
+    def remove(self, value: float):
+        # value must have been added before
+        self.count = self.count - 1
+        self.sum = self.sum - value
+        self.values[value] = self.values[value] - 1
+        if self.values[value] == 0:
+            del self.values[value]
+
+    def merge(self, other: "ExactQuantiles"):
+        self.count = self.count + other.count
+        self.sum = self.sum + other.sum
+        self.values.update(other.values)
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            raise ValueError("cannot compute a quantile of no samples")
+
+        # same rank as samples[int(len(samples) * q)] on a sorted list
+        rank = min(int(self.count * q), self.count - 1)
+        cumulated = 0
+        for value in sorted(self.values):
+            cumulated = cumulated + self.values[value]
+            if rank < cumulated:
+                return value